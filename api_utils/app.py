@@ -347,17 +347,8 @@ class APIKeyAuthMiddleware(BaseHTTPMiddleware):
             ):
                 return await call_next(request)
 
-        # 支持多种认证头格式以兼容OpenAI标准
-        api_key = None
-
-        # 1. 优先检查标准的 Authorization: Bearer <token> 头
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            api_key = auth_header[7:]  # 移除 "Bearer " 前缀
-
-        # 2. 回退到自定义的 X-API-Key 头（向后兼容）
-        if not api_key:
-            api_key = request.headers.get("X-API-Key")
+        # 支持 Authorization: Bearer <token> 与 X-API-Key（向后兼容）两种认证头
+        api_key = auth_utils.extract_api_key(request.headers)
 
         if not api_key or not auth_utils.verify_api_key(api_key):
             return JSONResponse(
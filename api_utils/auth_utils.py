@@ -1,5 +1,7 @@
 import os
-from typing import Set
+import threading
+import time
+from typing import Iterable, Mapping, Optional, Set, Tuple
 
 API_KEYS: Set[str] = set()
 KEY_FILE_PATH = os.path.join(
@@ -7,26 +9,95 @@ KEY_FILE_PATH = os.path.join(
     "auth_profiles",
     "key.txt",
 )
+# (st_mtime_ns, st_size) of the key file at the last load; None forces a reload
+_loaded_file_signature: Optional[Tuple[int, int]] = None
+# initialize_keys() stats the key file at most once per interval (seconds)
+KEY_FILE_CHECK_INTERVAL = 1.0
+_last_check_monotonic: Optional[float] = None
+# Serializes key file writes; the write helpers may run in worker threads
+_key_file_write_lock = threading.Lock()
 
 
 def load_api_keys():
     """Loads API keys from the key file into the API_KEYS set."""
-    global API_KEYS
-    API_KEYS.clear()
+    keys: Set[str] = set()
     if os.path.exists(KEY_FILE_PATH):
         with open(KEY_FILE_PATH, "r") as f:
-            for line in f:
-                key = line.strip()
-                if key:
-                    API_KEYS.add(key)
+            keys = {key for key in (line.strip() for line in f) if key}
+    # Swap contents only after a successful read so a failed read never
+    # leaves API_KEYS empty (which would disable key validation).
+    API_KEYS.clear()
+    API_KEYS.update(keys)
 
 
 def initialize_keys():
-    """Initializes API keys. Ensures key.txt exists and loads keys."""
+    """Initializes API keys. Ensures key.txt exists and loads keys.
+
+    The file is only re-read when its mtime or size changed since the last load,
+    and is checked at most once per KEY_FILE_CHECK_INTERVAL seconds.
+    """
+    global _loaded_file_signature, _last_check_monotonic
+    now = time.monotonic()
+    if (
+        _last_check_monotonic is not None
+        and now - _last_check_monotonic < KEY_FILE_CHECK_INTERVAL
+    ):
+        return
+    _last_check_monotonic = now
     if not os.path.exists(KEY_FILE_PATH):
         with open(KEY_FILE_PATH, "w"):
             pass  # Create an empty file
+    try:
+        st = os.stat(KEY_FILE_PATH)
+        signature: Optional[Tuple[int, int]] = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        signature = None
+    if signature is not None and signature == _loaded_file_signature:
+        return
     load_api_keys()
+    _loaded_file_signature = signature
+
+
+def _remember_file_signature() -> None:
+    """Records the key file signature so our own writes don't trigger a reload."""
+    global _loaded_file_signature
+    try:
+        st = os.stat(KEY_FILE_PATH)
+        _loaded_file_signature = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        _loaded_file_signature = None
+
+
+def append_api_key(key: str) -> None:
+    """Appends a key to the key file.
+
+    Only touches the file; the caller updates API_KEYS on the event loop.
+    Performs blocking file I/O; async callers should run it via asyncio.to_thread.
+    """
+    with _key_file_write_lock:
+        with open(KEY_FILE_PATH, "ab+") as f:
+            f.seek(0, os.SEEK_END)
+            needs_newline = False
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+            f.write((("\n" if needs_newline else "") + key + "\n").encode("utf-8"))
+        _remember_file_signature()
+
+
+def write_api_keys(keys: Iterable[str]) -> None:
+    """Atomically rewrites the key file with the given keys.
+
+    Pass a snapshot of the keys rather than API_KEYS itself; the caller updates
+    API_KEYS on the event loop. Performs blocking file I/O; async callers should
+    run it via asyncio.to_thread.
+    """
+    with _key_file_write_lock:
+        tmp_path = KEY_FILE_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(f"{k}\n" for k in sorted(keys))
+        os.replace(tmp_path, KEY_FILE_PATH)
+        _remember_file_signature()
 
 
 def verify_api_key(api_key_from_header: str) -> bool:
@@ -37,3 +108,16 @@ def verify_api_key(api_key_from_header: str) -> bool:
     if not API_KEYS:
         return True
     return api_key_from_header in API_KEYS
+
+
+def extract_api_key(headers: Mapping[str, str]) -> Optional[str]:
+    """
+    Extracts the API key from request headers.
+    Prefers 'Authorization: Bearer <key>' and falls back to 'X-API-Key'.
+    """
+    auth_header = headers.get("Authorization")
+    if auth_header and auth_header[:7] == "Bearer ":
+        api_key = auth_header[7:]
+        if api_key:
+            return api_key
+    return headers.get("X-API-Key")
@@ -6,6 +6,9 @@ import logging
 from asyncio import Event, Lock, Queue
 from typing import Any, Dict, List, Set
 
+from fastapi import HTTPException, Request
+
+from api_utils import auth_utils
 from api_utils.context_types import QueueItem
 
 
@@ -84,3 +87,23 @@ def get_current_ai_studio_model_id() -> str:
     from server import current_ai_studio_model_id
 
     return current_ai_studio_model_id
+
+
+async def verify_api_key_access(request: Request) -> bool:
+    """验证管理端点（API 密钥、配置页面）的访问权限
+
+    如果配置了 API 密钥，则需要提供有效的 API 密钥
+    如果没有配置 API 密钥，则允许访问（向后兼容）
+    """
+    auth_utils.initialize_keys()
+    if not auth_utils.API_KEYS:
+        return True
+
+    api_key = auth_utils.extract_api_key(request.headers)
+    if not api_key or not auth_utils.verify_api_key(api_key):
+        raise HTTPException(
+            status_code=401,
+            detail="需要有效的 API 密钥才能访问此端点。请使用 'Authorization: Bearer <your_key>' 或 'X-API-Key: <your_key>' 头。",
+        )
+
+    return True
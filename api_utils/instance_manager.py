@@ -1,26 +1,51 @@
 """
 多实例管理器 - 管理多个浏览器实例和负载均衡
 """
-import asyncio
+import array
+import heapq
+import itertools
 import logging
 import os
+import random
+import sys
+import time
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from enum import Enum
 
+import orjson
 from playwright.async_api import Browser as AsyncBrowser, Page as AsyncPage
 
 logger = logging.getLogger("InstanceManager")
 
+# 统计 JSON 缓存有效期（秒），统计本身是近似值，允许短暂滞后
+STATS_CACHE_TTL = 1.0
+
+# 延迟 EWMA 中新样本的权重
+LATENCY_EWMA_ALPHA = 0.2
+# 延迟 EWMA 随闲置时间衰减的半衰期（秒）：偶发的慢样本不会让实例永久落选
+LATENCY_DECAY_HALF_LIFE = 30.0
+# 失败请求计入延迟 EWMA 的最小耗时（毫秒）：持续失败的实例不会因为没有延迟样本而显得最快
+LATENCY_FAILURE_PENALTY_MS = 60000.0
+
 
 class LoadBalanceStrategy(str, Enum):
     """负载均衡策略"""
     ROUND_ROBIN = "round_robin"  # 轮询
     RANDOM = "random"  # 随机
-    LEAST_CONNECTIONS = "least_connections"  # 最少连接
+    LEAST_CONNECTIONS = "least_connections"  # 最少连接（按处理中请求数）
+    POWER_OF_TWO_CHOICES = "power_of_two_choices"  # 随机二选一（取处理中请求较少者）
+    LEAST_LATENCY = "least_latency"  # 最低延迟（按处理中请求数加权的 EWMA 响应时间随机二选一）
+
+
+# 影响可用实例快照的字段
+_SNAPSHOT_FIELDS = ("enabled", "is_ready")
+
+# dataclass(slots=True) 需要 Python 3.10+，旧版本退回普通 __dict__ 实例
+_DATACLASS_OPTIONS: Dict[str, Any] = {"slots": True} if sys.version_info >= (3, 10) else {}
 
 
-@dataclass
+@dataclass(**_DATACLASS_OPTIONS)
 class BrowserInstance:
     """浏览器实例信息"""
     id: str
@@ -30,10 +55,57 @@ class BrowserInstance:
     ws_endpoint: str = ""
     port: int = 0
     is_ready: bool = False
-    request_count: int = 0
+    request_count: int = 0  # 累计请求数
     error_count: int = 0
+    active_requests: int = 0  # 正在处理中的请求数
     enabled: bool = True
-    last_used: float = field(default_factory=lambda: asyncio.get_event_loop().time())
+    ewma_latency_ms: float = 0.0  # 请求耗时的指数加权移动平均，0 表示尚无样本
+    last_used: float = field(default_factory=time.monotonic)
+    # 所属管理器的快照重建回调，由 add_instance 设置
+    _on_state_change: Optional[Callable[[], None]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+
+class _SnapshotField:
+    """enabled / is_ready 的数据描述符：值真正变化时通知管理器重建可用实例快照
+
+    只拦截这两个字段，其余字段的写入仍是普通的槽位赋值，不经过 Python 层回调。
+    """
+    
+    def __init__(self, name: str, slot: Any) -> None:
+        self._name = name
+        # slots 模式下为原槽位描述符；否则值存放在实例 __dict__ 中
+        self._slot = slot if hasattr(slot, "__set__") else None
+    
+    def __get__(self, obj: Any, objtype: Any = None) -> Any:
+        if obj is None:
+            return self
+        if self._slot is not None:
+            return self._slot.__get__(obj, objtype)
+        try:
+            return obj.__dict__[self._name]
+        except KeyError:
+            raise AttributeError(self._name) from None
+    
+    def __set__(self, obj: Any, value: Any) -> None:
+        # __init__ 期间字段尚未赋值，视为发生变化
+        changed = getattr(obj, self._name, _MISSING) != value
+        if self._slot is not None:
+            self._slot.__set__(obj, value)
+        else:
+            obj.__dict__[self._name] = value
+        if changed:
+            # __init__ 期间回调尚未赋值，getattr 默认值兜底
+            callback = getattr(obj, "_on_state_change", None)
+            if callback is not None:
+                callback()
+
+
+_MISSING = object()
+
+for _name in _SNAPSHOT_FIELDS:
+    setattr(BrowserInstance, _name, _SnapshotField(_name, BrowserInstance.__dict__.get(_name)))
 
 
 class MultiInstanceManager:
@@ -42,56 +114,220 @@ class MultiInstanceManager:
     def __init__(self, strategy: LoadBalanceStrategy = LoadBalanceStrategy.ROUND_ROBIN):
         self.instances: Dict[str, BrowserInstance] = {}
         self.strategy = strategy
-        self.current_index = 0
-        self.lock = asyncio.Lock()
+        # 轮询计数器：next() 由 C 实现，单事件循环内无需加锁
+        self._rr_counter = itertools.count()
+        # 可用实例快照（写时复制）：仅在成员或状态变更时整体替换，请求路径只读
+        self._enabled_snapshot: Tuple[BrowserInstance, ...] = ()
+        self._enabled_pos: Dict[str, int] = {}
+        # 按快照下标排列的处理中请求数与累计请求数，选择时直接按下标读取
+        self._inflight = array.array("Q")
+        self._totals = array.array("Q")
+        # 最少连接小顶堆：(处理中请求数, 累计请求数, 快照下标)，计数变化时压入新条目，过期条目在选择时惰性丢弃
+        # 单队列串行处理时处理中请求数通常全为 0，以累计请求数打破平局，使请求轮流分配
+        self._lc_heap: List[Tuple[int, int, int]] = []
+        # 序列化后的实例统计缓存：(生成时间, JSON 字节)
+        self._stats_cache: Optional[Tuple[float, bytes]] = None
     
-    def add_instance(self, instance: BrowserInstance) -> None:
-        """添加浏览器实例"""
+    def _rebuild_heap(self) -> None:
+        """按当前处理中请求数重建最少连接堆（仅在最少连接策略下维护）"""
+        if self.strategy != LoadBalanceStrategy.LEAST_CONNECTIONS:
+            self._lc_heap = []
+            return
+        totals = self._totals
+        heap = [(count, totals[pos], pos) for pos, count in enumerate(self._inflight)]
+        heapq.heapify(heap)
+        self._lc_heap = heap
+    
+    def _push_heap(self, pos: int) -> None:
+        """处理中请求数变化后为该下标压入新的堆条目"""
+        if self.strategy != LoadBalanceStrategy.LEAST_CONNECTIONS:
+            return
+        heapq.heappush(self._lc_heap, (self._inflight[pos], self._totals[pos], pos))
+        # 过期条目只在到达堆顶时丢弃，长期不选择时定期压缩
+        if len(self._lc_heap) > 4 * len(self._inflight) + 16:
+            self._rebuild_heap()
+    
+    @staticmethod
+    def _decayed_latency(instance: BrowserInstance, now: float) -> float:
+        """按自上次使用以来的闲置时间衰减后的延迟 EWMA"""
+        idle = now - instance.last_used
+        if idle <= 0:
+            return instance.ewma_latency_ms
+        return instance.ewma_latency_ms * 0.5 ** (idle / LATENCY_DECAY_HALF_LIFE)
+    
+    def _latency_score(self, instance: BrowserInstance, now: float) -> float:
+        """最低延迟策略得分：衰减后的延迟乘以 (处理中请求数 + 1)"""
+        return self._decayed_latency(instance, now) * (instance.active_requests + 1)
+    
+    def _rebuild_snapshot(self) -> None:
+        """重建可用实例快照（添加/移除/启用/就绪状态变更时调用）"""
+        snapshot = tuple(inst for inst in self.instances.values() if inst.enabled and inst.is_ready)
+        self._enabled_pos = {inst.id: pos for pos, inst in enumerate(snapshot)}
+        self._inflight = array.array("Q", (inst.active_requests for inst in snapshot))
+        self._totals = array.array("Q", (inst.request_count for inst in snapshot))
+        self._rebuild_heap()
+        self._enabled_snapshot = snapshot
+        self._stats_cache = None
+    
+    def _attach(self, instance: BrowserInstance) -> None:
+        """登记实例并挂接状态变更回调（不重建快照）"""
+        previous = self.instances.get(instance.id)
+        if previous is not None and previous is not instance:
+            previous._on_state_change = None
         self.instances[instance.id] = instance
+        instance._on_state_change = self._rebuild_snapshot
         logger.info(f"添加浏览器实例: {instance.id} (认证文件: {os.path.basename(instance.auth_file)})")
     
+    def add_instance(self, instance: BrowserInstance) -> None:
+        """添加浏览器实例"""
+        self._attach(instance)
+        self._rebuild_snapshot()
+    
+    def add_instances(self, instances: Iterable[BrowserInstance]) -> None:
+        """批量添加浏览器实例，全部登记后只重建一次快照"""
+        for instance in instances:
+            self._attach(instance)
+        self._rebuild_snapshot()
+    
     def remove_instance(self, instance_id: str) -> None:
         """移除浏览器实例"""
-        if instance_id in self.instances:
-            del self.instances[instance_id]
+        instance = self.instances.pop(instance_id, None)
+        if instance is not None:
+            instance._on_state_change = None
+            self._rebuild_snapshot()
             logger.info(f"移除浏览器实例: {instance_id}")
     
+    def clear(self) -> None:
+        """移除所有实例并重置轮询位置"""
+        for inst in self.instances.values():
+            inst._on_state_change = None
+        self.instances.clear()
+        self._rr_counter = itertools.count()
+        self._rebuild_snapshot()
+    
     def get_enabled_instances(self) -> List[BrowserInstance]:
         """获取所有启用的实例"""
-        return [inst for inst in self.instances.values() if inst.enabled and inst.is_ready]
+        return list(self._enabled_snapshot)
+    
+    def enabled_count(self) -> int:
+        """获取启用实例数量（直接读取快照长度，不复制列表）"""
+        return len(self._enabled_snapshot)
     
     async def get_next_instance(self) -> Optional[BrowserInstance]:
-        """根据策略获取下一个可用实例"""
-        async with self.lock:
-            enabled = self.get_enabled_instances()
-            if not enabled:
-                logger.warning("没有可用的浏览器实例")
-                return None
-            
-            if self.strategy == LoadBalanceStrategy.ROUND_ROBIN:
-                instance = enabled[self.current_index % len(enabled)]
-                self.current_index = (self.current_index + 1) % len(enabled)
-                return instance
-            
-            elif self.strategy == LoadBalanceStrategy.RANDOM:
-                import random
-                return random.choice(enabled)
-            
-            elif self.strategy == LoadBalanceStrategy.LEAST_CONNECTIONS:
-                return min(enabled, key=lambda x: x.request_count)
-            
-            return enabled[0] if enabled else None
+        """根据策略获取下一个可用实例
+
+        选择过程不含 await，也不加锁：快照只在同步的变更方法中整体替换，
+        请求计数的读取允许轻微滞后（负载均衡本身就是近似）。
+        """
+        snapshot = self._enabled_snapshot
+        if not snapshot:
+            logger.warning("没有可用的浏览器实例")
+            return None
+        
+        # 只有一个可用实例时无需经过策略选择（常见的单账号部署）
+        if len(snapshot) == 1:
+            return snapshot[0]
+        
+        if self.strategy == LoadBalanceStrategy.ROUND_ROBIN:
+            idx = next(self._rr_counter) % len(snapshot)
+        
+        elif self.strategy == LoadBalanceStrategy.RANDOM:
+            idx = random.randrange(len(snapshot))
+        
+        elif self.strategy == LoadBalanceStrategy.LEAST_CONNECTIONS:
+            heap = self._lc_heap
+            counts = self._inflight
+            totals = self._totals
+            # 每个下标至少有一个与实时计数一致的条目，正常情况下不会弹空
+            while heap and (
+                heap[0][0] != counts[heap[0][2]] or heap[0][1] != totals[heap[0][2]]
+            ):
+                heapq.heappop(heap)
+            if not heap:
+                self._rebuild_heap()
+                heap = self._lc_heap
+            idx = heap[0][2]
+        
+        elif self.strategy == LoadBalanceStrategy.POWER_OF_TWO_CHOICES:
+            # 随机取两个实例比较处理中请求数（平局时比较累计请求数），避免并发时全部涌向同一个最小值实例
+            a, b = random.sample(range(len(snapshot)), 2)
+            counts = self._inflight
+            totals = self._totals
+            idx = a if (counts[a], totals[a]) <= (counts[b], totals[b]) else b
+        
+        elif self.strategy == LoadBalanceStrategy.LEAST_LATENCY:
+            # 随机二选一比较得分，避免所有请求涌向当前最快的实例；
+            # 尚无样本的实例得分为 0，会被优先选中以获得首个样本
+            a, b = random.sample(range(len(snapshot)), 2)
+            now = time.monotonic()
+            score_a = self._latency_score(snapshot[a], now)
+            idx = a if score_a <= self._latency_score(snapshot[b], now) else b
+        
+        else:
+            idx = 0
+        
+        return snapshot[idx]
     
     def mark_request_start(self, instance_id: str) -> None:
-        """标记请求开始"""
-        if instance_id in self.instances:
-            self.instances[instance_id].request_count += 1
-            self.instances[instance_id].last_used = asyncio.get_event_loop().time()
+        """标记请求开始
+
+        计数的读-改-写之间没有 await，所有调用都在同一事件循环线程中执行，
+        协程之间不会交错，因此无需加锁；本管理器不支持跨线程调用。
+        """
+        instance = self.instances.get(instance_id)
+        if instance is not None:
+            now = time.monotonic()
+            instance.request_count += 1
+            instance.active_requests += 1
+            # 先把闲置期间的衰减折算进 EWMA，再刷新最后使用时间
+            instance.ewma_latency_ms = self._decayed_latency(instance, now)
+            instance.last_used = now
+            pos = self._enabled_pos.get(instance_id)
+            if pos is not None:
+                self._inflight[pos] += 1
+                self._totals[pos] += 1
+                self._push_heap(pos)
+    
+    def mark_request_end(
+        self, instance_id: str, elapsed_ms: Optional[float] = None, failed: bool = False
+    ) -> None:
+        """标记请求结束；提供耗时（毫秒）时更新延迟 EWMA，失败的请求按惩罚耗时计入"""
+        instance = self.instances.get(instance_id)
+        if instance is not None:
+            # 先比较再递减：重复或多余的结束标记不会让计数变为负数
+            if instance.active_requests > 0:
+                instance.active_requests -= 1
+                pos = self._enabled_pos.get(instance_id)
+                if pos is not None and self._inflight[pos] > 0:
+                    self._inflight[pos] -= 1
+                    self._push_heap(pos)
+            if failed:
+                elapsed_ms = max(elapsed_ms or 0.0, LATENCY_FAILURE_PENALTY_MS)
+            elif elapsed_ms is None:
+                return
+            old = instance.ewma_latency_ms
+            if old == 0.0:
+                # 首个样本直接作为初值，避免从 0 缓慢爬升
+                instance.ewma_latency_ms = elapsed_ms
+            else:
+                instance.ewma_latency_ms = (
+                    (1 - LATENCY_EWMA_ALPHA) * old + LATENCY_EWMA_ALPHA * elapsed_ms
+                )
+    
+    def get_inflight(self, instance_id: str) -> int:
+        """获取实例当前处理中的请求数"""
+        instance = self.instances.get(instance_id)
+        return instance.active_requests if instance is not None else 0
+    
+    def total_inflight(self) -> int:
+        """获取所有实例处理中的请求总数"""
+        return sum(inst.active_requests for inst in self.instances.values())
     
     def mark_request_error(self, instance_id: str) -> None:
         """标记请求错误"""
-        if instance_id in self.instances:
-            self.instances[instance_id].error_count += 1
+        instance = self.instances.get(instance_id)
+        if instance is not None:
+            instance.error_count += 1
     
     def get_stats(self) -> Dict[str, Dict[str, any]]:
         """获取所有实例的统计信息"""
@@ -103,20 +339,41 @@ class MultiInstanceManager:
                 "enabled": inst.enabled,
                 "request_count": inst.request_count,
                 "error_count": inst.error_count,
+                "active_requests": inst.active_requests,
+                "ewma_latency_ms": round(inst.ewma_latency_ms, 1),
                 "port": inst.port,
             }
             for instance_id, inst in self.instances.items()
         }
     
+    def get_stats_json(self) -> bytes:
+        """获取序列化后的实例统计信息（短时缓存，成员或状态变更时失效）"""
+        cache = self._stats_cache
+        now = time.monotonic()
+        if cache is not None and now - cache[0] < STATS_CACHE_TTL:
+            return cache[1]
+        data = orjson.dumps(self.get_stats())
+        self._stats_cache = (now, data)
+        return data
+    
     def set_strategy(self, strategy: LoadBalanceStrategy) -> None:
         """设置负载均衡策略"""
         self.strategy = strategy
+        self._rebuild_heap()
         logger.info(f"负载均衡策略已更改为: {strategy.value}")
     
+    def set_instance_ready(self, instance_id: str, is_ready: bool) -> None:
+        """更新实例就绪状态"""
+        instance = self.instances.get(instance_id)
+        if instance is not None:
+            # 赋值经 _SnapshotField 描述符拦截，值变化时触发快照重建
+            instance.is_ready = is_ready
+    
     def enable_instance(self, instance_id: str, enabled: bool) -> None:
         """启用/禁用实例"""
-        if instance_id in self.instances:
-            self.instances[instance_id].enabled = enabled
+        instance = self.instances.get(instance_id)
+        if instance is not None:
+            instance.enabled = enabled
             logger.info(f"实例 {instance_id} 已{'启用' if enabled else '禁用'}")
 
 
@@ -2,12 +2,16 @@
 负载均衡器 - 请求分发逻辑
 """
 import logging
-from typing import Optional
+import time
+from typing import Dict, Optional, Tuple
 
 from api_utils.instance_manager import instance_manager, BrowserInstance
 
 logger = logging.getLogger("LoadBalancer")
 
+# 进行中的请求：req_id -> (实例, 开始时间)，由队列工作器在请求真正完成后结束
+_pending_requests: Dict[str, Tuple[BrowserInstance, float]] = {}
+
 
 class LoadBalancer:
     """负载均衡器"""
@@ -17,7 +21,11 @@ class LoadBalancer:
         """获取下一个可用的浏览器实例"""
         instance = await instance_manager.get_next_instance()
         if instance:
-            logger.debug(f"选择实例: {instance.id} (请求数: {instance.request_count})")
+            # 使用 % 占位符，日志级别未启用时不进行格式化
+            logger.debug(
+                "选择实例: %s (请求数: %d, 处理中: %d)",
+                instance.id, instance.request_count, instance.active_requests,
+            )
         return instance
     
     @staticmethod
@@ -25,6 +33,31 @@ class LoadBalancer:
         """标记请求开始"""
         instance_manager.mark_request_start(instance.id)
     
+    @staticmethod
+    def mark_request_end(
+        instance: BrowserInstance, elapsed_ms: Optional[float] = None, failed: bool = False
+    ) -> None:
+        """标记请求结束，记录本次请求耗时（毫秒）；失败的请求按惩罚耗时计入"""
+        instance_manager.mark_request_end(instance.id, elapsed_ms, failed)
+    
+    @staticmethod
+    def begin_request(req_id: str, instance: BrowserInstance) -> None:
+        """登记请求使用的实例并标记开始"""
+        # 同一请求重试时，上一次未结束的登记按失败结束
+        LoadBalancer.finish_request(req_id, succeeded=False)
+        instance_manager.mark_request_start(instance.id)
+        _pending_requests[req_id] = (instance, time.monotonic())
+    
+    @staticmethod
+    def finish_request(req_id: str, succeeded: bool) -> None:
+        """结束请求的实例登记并记录耗时，失败时按惩罚耗时计入；未登记的请求忽略"""
+        pending = _pending_requests.pop(req_id, None)
+        if pending is None:
+            return
+        instance, started_at = pending
+        elapsed_ms = (time.monotonic() - started_at) * 1000
+        instance_manager.mark_request_end(instance.id, elapsed_ms, failed=not succeeded)
+    
     @staticmethod
     def mark_request_error(instance: BrowserInstance) -> None:
         """标记请求错误"""
@@ -36,7 +69,8 @@ class LoadBalancer:
         return {
             "strategy": instance_manager.strategy.value,
             "total_instances": len(instance_manager.instances),
-            "enabled_instances": len(instance_manager.get_enabled_instances()),
+            "enabled_instances": instance_manager.enabled_count(),
+            "inflight_requests": instance_manager.total_inflight(),
             "instances": instance_manager.get_stats(),
         }
 
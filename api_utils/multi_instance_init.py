@@ -4,8 +4,7 @@
 import asyncio
 import logging
 import os
-import glob
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 from playwright.async_api import Browser as AsyncBrowser
 
@@ -19,6 +18,106 @@ from launcher.config import SAVED_AUTH_DIR, ACTIVE_AUTH_DIR
 
 logger = logging.getLogger("MultiInstanceInit")
 
+# 进程启动时即已确定的环境配置，导入时读取一次
+_ENABLE_MULTI_INSTANCE = os.environ.get("ENABLE_MULTI_INSTANCE", "false").lower() == "true"
+_WS_ENDPOINT = os.environ.get("CAMOUFOX_WS_ENDPOINT")
+_DEFAULT_PORT = int(os.environ.get("DEFAULT_CAMOUFOX_PORT", "9222"))
+
+
+def _login_may_prompt() -> bool:
+    """非 headless 模式下页面初始化遇到登录页会阻塞等待终端输入"""
+    if os.environ.get("LAUNCH_MODE", "debug") == "headless":
+        return False
+    return os.environ.get("SUPPRESS_LOGIN_WAIT", "").lower() not in ("1", "true", "yes")
+
+
+def _scan_json_files(directory: str) -> List[Tuple[str, str]]:
+    """返回目录中 JSON 文件的 (文件名, 路径) 列表"""
+    with os.scandir(directory) as it:
+        return [
+            (entry.name, entry.path)
+            for entry in it
+            if entry.name.endswith(".json") and entry.is_file()
+        ]
+
+
+async def _initialize_instance(
+    playwright_manager,
+    idx: int,
+    auth_file: str,
+    base_port: int,
+    verify_exists: bool,
+    serial_lock: asyncio.Lock,
+) -> Optional[BrowserInstance]:
+    """初始化单个浏览器实例，失败时返回 None
+
+    连接与页面导航可与其他实例并发；手动登录与模型状态处理通过 serial_lock 串行执行。
+    """
+    if verify_exists and not os.path.exists(auth_file):
+        logger.warning(f"认证文件不存在: {auth_file}")
+        return None
+    
+    instance_id = f"instance_{idx}"
+    port = base_port + idx
+    
+    try:
+        # 注意：当前实现使用同一个 WebSocket 端点
+        # 真正的多实例需要启动多个 Camoufox 进程，每个使用不同的端口和认证文件
+        # 这里先实现简化版本：使用同一个浏览器实例，但支持不同的认证文件切换
+        ws_endpoint = _WS_ENDPOINT
+        
+        if not ws_endpoint:
+            logger.warning(f"实例 {instance_id} 缺少 WebSocket 端点，跳过")
+            return None
+        
+        # 对于简化版本，我们使用同一个浏览器实例，但记录不同的认证文件
+        # 这样可以在错误恢复时切换到不同的认证文件
+        
+        logger.info(f"连接实例 {instance_id} (端口: {port}, 认证: {os.path.basename(auth_file)})")
+        
+        # 连接到浏览器
+        browser = await playwright_manager.firefox.connect(ws_endpoint, timeout=30000)
+        logger.info(f"实例 {instance_id} 浏览器连接成功")
+        
+        # 初始化页面；可能需要手动登录时，终端输入只能逐个实例进行
+        if _login_may_prompt():
+            async with serial_lock:
+                page, is_ready = await initialize_page_logic(
+                    browser,
+                    storage_state_path=auth_file,
+                )
+        else:
+            page, is_ready = await initialize_page_logic(
+                browser,
+                storage_state_path=auth_file,
+            )
+        
+        if is_ready:
+            # 模型状态处理会读写全局 state.current_ai_studio_model_id，需串行执行
+            async with serial_lock:
+                await _handle_initial_model_state_and_storage(page)
+                await enable_temporary_chat_mode(page)
+            
+            logger.info(f"实例 {instance_id} 初始化成功")
+            # 创建实例对象
+            return BrowserInstance(
+                id=instance_id,
+                auth_file=auth_file,
+                browser=browser,
+                page=page,
+                ws_endpoint=ws_endpoint,
+                port=port,
+                is_ready=True,
+            )
+        
+        logger.error(f"实例 {instance_id} 页面初始化失败")
+        await browser.close()
+    
+    except Exception as e:
+        logger.error(f"初始化实例 {instance_id} 时出错: {e}", exc_info=True)
+    
+    return None
+
 
 async def initialize_multiple_browsers(
     playwright_manager,
@@ -36,6 +135,8 @@ async def initialize_multiple_browsers(
     Returns:
         是否成功初始化至少一个实例
     """
+    # 从目录扫描得到的文件已由 scandir 确认存在，无需再次检查
+    verify_exists = auth_files is not None
     if auth_files is None:
         # 多实例模式：优先从 saved 目录读取所有认证文件
         # saved/ 目录是所有认证文件的存储库（主要来源）
@@ -45,22 +146,20 @@ async def initialize_multiple_browsers(
         
         # 优先从 saved 目录读取（主要来源）
         if os.path.exists(SAVED_AUTH_DIR):
-            pattern = os.path.join(SAVED_AUTH_DIR, "*.json")
-            files = glob.glob(pattern)
-            auth_files.extend(files)
-            seen_basenames.update(os.path.basename(f) for f in files)
-            logger.info(f"从 saved/ 目录找到 {len(files)} 个认证文件")
+            entries = _scan_json_files(SAVED_AUTH_DIR)
+            auth_files.extend(path for _, path in entries)
+            seen_basenames.update(name for name, _ in entries)
+            logger.info(f"从 saved/ 目录找到 {len(entries)} 个认证文件")
         
         # 也从 active 目录读取（兼容单实例模式）
         if os.path.exists(ACTIVE_AUTH_DIR):
-            pattern = os.path.join(ACTIVE_AUTH_DIR, "*.json")
-            files = glob.glob(pattern)
+            entries = _scan_json_files(ACTIVE_AUTH_DIR)
             # 避免重复（如果 active 中的文件也在 saved 中）
-            for f in files:
-                if os.path.basename(f) not in seen_basenames:
-                    auth_files.append(f)
-                    seen_basenames.add(os.path.basename(f))
-            logger.info(f"从 active/ 目录找到 {len(files)} 个认证文件（去重后）")
+            for name, path in entries:
+                if name not in seen_basenames:
+                    auth_files.append(path)
+                    seen_basenames.add(name)
+            logger.info(f"从 active/ 目录找到 {len(entries)} 个认证文件（去重后）")
         
         if not auth_files:
             logger.warning("未找到认证文件，使用单实例模式")
@@ -69,70 +168,31 @@ async def initialize_multiple_browsers(
     logger.info(f"开始初始化 {len(auth_files)} 个浏览器实例...")
     
     # 检查是否启用多实例模式
-    use_multi_instance = os.environ.get("ENABLE_MULTI_INSTANCE", "false").lower() == "true"
-    if not use_multi_instance and len(auth_files) > 1:
+    if not _ENABLE_MULTI_INSTANCE and len(auth_files) > 1:
         logger.info("多实例模式未启用，仅使用第一个认证文件")
         auth_files = auth_files[:1]
     
-    success_count = 0
-    
-    for idx, auth_file in enumerate(auth_files):
-        if not os.path.exists(auth_file):
-            logger.warning(f"认证文件不存在: {auth_file}")
-            continue
-        
-        instance_id = f"instance_{idx}"
-        port = base_port + idx
-        
-        try:
-            # 注意：当前实现使用同一个 WebSocket 端点
-            # 真正的多实例需要启动多个 Camoufox 进程，每个使用不同的端口和认证文件
-            # 这里先实现简化版本：使用同一个浏览器实例，但支持不同的认证文件切换
-            ws_endpoint = os.environ.get("CAMOUFOX_WS_ENDPOINT")
-            
-            if not ws_endpoint:
-                logger.warning(f"实例 {instance_id} 缺少 WebSocket 端点，跳过")
-                continue
-            
-            # 对于简化版本，我们使用同一个浏览器实例，但记录不同的认证文件
-            # 这样可以在错误恢复时切换到不同的认证文件
-            
-            logger.info(f"连接实例 {instance_id} (端口: {port}, 认证: {os.path.basename(auth_file)})")
-            
-            # 连接到浏览器
-            browser = await playwright_manager.firefox.connect(ws_endpoint, timeout=30000)
-            logger.info(f"实例 {instance_id} 浏览器连接成功")
-            
-            # 初始化页面
-            page, is_ready = await initialize_page_logic(
-                browser,
-                storage_state_path=auth_file,
+    # 各实例的连接与页面导航相互独立，并发执行以缩短启动时间
+    serial_lock = asyncio.Lock()
+    results = await asyncio.gather(
+        *(
+            _initialize_instance(
+                playwright_manager, idx, auth_file, base_port, verify_exists, serial_lock
             )
-            
-            if is_ready:
-                await _handle_initial_model_state_and_storage(page)
-                await enable_temporary_chat_mode(page)
-                
-                # 创建实例对象
-                instance = BrowserInstance(
-                    id=instance_id,
-                    auth_file=auth_file,
-                    browser=browser,
-                    page=page,
-                    ws_endpoint=ws_endpoint,
-                    port=port,
-                    is_ready=True,
-                )
-                
-                instance_manager.add_instance(instance)
-                success_count += 1
-                logger.info(f"实例 {instance_id} 初始化成功")
-            else:
-                logger.error(f"实例 {instance_id} 页面初始化失败")
-                await browser.close()
-        
-        except Exception as e:
-            logger.error(f"初始化实例 {instance_id} 时出错: {e}", exc_info=True)
+            for idx, auth_file in enumerate(auth_files)
+        ),
+        return_exceptions=True,
+    )
+    
+    ready_instances: List[BrowserInstance] = []
+    # 按认证文件顺序添加，保持轮询顺序稳定
+    for idx, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.error(f"初始化实例 instance_{idx} 时出错: {result}", exc_info=result)
+        elif result is not None:
+            ready_instances.append(result)
+    instance_manager.add_instances(ready_instances)
+    success_count = len(ready_instances)
     
     if success_count > 0:
         logger.info(f"成功初始化 {success_count}/{len(auth_files)} 个浏览器实例")
@@ -151,7 +211,7 @@ async def initialize_single_browser_fallback(
     """
     from api_utils.app import _initialize_page_logic
     
-    ws_endpoint = os.environ.get("CAMOUFOX_WS_ENDPOINT")
+    ws_endpoint = _WS_ENDPOINT
     if not ws_endpoint:
         logger.warning("未找到 WebSocket 端点，无法初始化浏览器")
         return False
@@ -168,7 +228,7 @@ async def initialize_single_browser_fallback(
                 browser=browser,
                 page=page,
                 ws_endpoint=ws_endpoint,
-                port=int(os.environ.get("DEFAULT_CAMOUFOX_PORT", "9222")),
+                port=_DEFAULT_PORT,
                 is_ready=True,
             )
             instance_manager.add_instance(instance)
@@ -14,6 +14,7 @@ from fastapi.responses import JSONResponse, StreamingResponse
 from playwright.async_api import Locator
 
 from api_utils.context_types import QueueItem
+from api_utils.load_balancer import load_balancer
 from logging_utils import set_request_id, set_source
 from models import ChatCompletionRequest
 
@@ -381,6 +382,7 @@ class QueueManager:
         # 确保日志上下文已设置
         set_request_id(req_id)
 
+        succeeded = False
         try:
             from api_utils import (
                 _process_request_refactored,  # pyright: ignore[reportPrivateUsage]
@@ -436,6 +438,9 @@ class QueueManager:
                 current_request_was_streaming,
                 stream_state,
             )
+            succeeded = not result_future.done() or (
+                not result_future.cancelled() and result_future.exception() is None
+            )
 
         except asyncio.CancelledError:
             self.logger.info("(Worker) Execution cancelled.")
@@ -448,6 +453,9 @@ class QueueManager:
                 )
             # 重新抛出异常以触发重试机制
             raise
+        finally:
+            # 流式响应在 completion_event 触发后才算完成，此时再结束负载均衡实例的请求
+            load_balancer.finish_request(req_id, succeeded)
 
     async def _monitor_completion(
         self,
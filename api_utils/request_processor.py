@@ -656,19 +656,22 @@ async def _process_request_refactored(  # pyright: ignore[reportUnusedFunction]
             logger.warning(f"Error clearing stream queue: {clear_err}")
 
     context = await _initialize_request_context(req_id, request)
-    context = await _analyze_model_requirements(req_id, context, request)
-
-    (
-        _,  # client_disconnected_event - not used, kept for unpacking
-        disconnect_check_task,
-        check_client_disconnected,
-    ) = await _setup_disconnect_monitoring(req_id, http_request, result_future)
-
-    page = context["page"]
-    submit_button_locator = page.locator(SUBMIT_BUTTON_SELECTOR) if page else None
+    disconnect_check_task: Optional[asyncio.Task[None]] = None
     completion_event = None
 
+    # 上下文初始化之后的失败都经过下方的异常处理与 finally 清理
     try:
+        context = await _analyze_model_requirements(req_id, context, request)
+
+        (
+            _,  # client_disconnected_event - not used, kept for unpacking
+            disconnect_check_task,
+            check_client_disconnected,
+        ) = await _setup_disconnect_monitoring(req_id, http_request, result_future)
+
+        page = context["page"]
+        submit_button_locator = page.locator(SUBMIT_BUTTON_SELECTOR) if page else None
+
         await _validate_page_status(req_id, context, check_client_disconnected)
 
         if page is None:
@@ -3,54 +3,26 @@
 """
 import logging
 import os
-import glob
 import json
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Request
+import orjson
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 
 from api_utils.instance_manager import instance_manager, LoadBalanceStrategy
 from launcher.config import SAVED_AUTH_DIR, ACTIVE_AUTH_DIR
-from .. import auth_utils
+from ..dependencies import verify_api_key_access
 
 logger = logging.getLogger("ConfigAPI")
 
-router = APIRouter(prefix="/api/config", tags=["config"])
+# 策略取值 -> 枚举的预计算映射，避免通过异常判断非法取值
+_STRATEGY_BY_VALUE: Dict[str, LoadBalanceStrategy] = {s.value: s for s in LoadBalanceStrategy}
 
-
-async def verify_config_access(request: Request):
-    """验证配置页面的访问权限
-    
-    如果配置了 API 密钥，则需要提供有效的 API 密钥
-    如果没有配置 API 密钥，则允许访问（向后兼容）
-    """
-    # 如果未配置 API 密钥，允许访问
-    auth_utils.initialize_keys()
-    if not auth_utils.API_KEYS:
-        return True
-    
-    # 从请求头获取 API 密钥
-    api_key = None
-    
-    # 1. 优先检查标准的 Authorization: Bearer <token> 头
-    auth_header = request.headers.get("Authorization")
-    if auth_header and auth_header.startswith("Bearer "):
-        api_key = auth_header[7:]  # 移除 "Bearer " 前缀
-    
-    # 2. 回退到自定义的 X-API-Key 头
-    if not api_key:
-        api_key = request.headers.get("X-API-Key")
-    
-    # 验证 API 密钥
-    if not api_key or not auth_utils.verify_api_key(api_key):
-        raise HTTPException(
-            status_code=401,
-            detail="需要有效的 API 密钥才能访问配置页面。请使用 'Authorization: Bearer <your_key>' 或 'X-API-Key: <your_key>' 头。"
-        )
-    
-    return True
+# 配置面板会频繁轮询，使用 orjson 序列化（camoufox 已依赖 orjson）
+router = APIRouter(prefix="/api/config", tags=["config"], default_response_class=ORJSONResponse)
 
 
 class AuthFileInfo(BaseModel):
@@ -76,61 +48,80 @@ class InstanceStats(BaseModel):
     enabled: bool
     request_count: int
     error_count: int
+    active_requests: int
+    ewma_latency_ms: float
     port: int
 
 
+# 认证文件列表缓存：以两个目录的 mtime 为键，目录内增删文件时自动失效
+_auth_files_cache: Optional[Tuple[Tuple[Optional[int], Optional[int]], List[Dict]]] = None
+
+
+def _dir_mtime_ns(path: str) -> Optional[int]:
+    """返回目录的 mtime（纳秒），目录不存在时返回 None"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _invalidate_auth_files_cache() -> None:
+    """清除认证文件列表缓存（文件内容被覆盖时目录 mtime 不一定变化）"""
+    global _auth_files_cache
+    _auth_files_cache = None
+
+
+def _scan_auth_files(directory: str, seen_basenames: set, auth_files: List[Dict]) -> None:
+    """扫描目录中的 JSON 认证文件，跳过已出现过的文件名"""
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not entry.name.endswith(".json") or entry.name in seen_basenames:
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                auth_files.append({
+                    "filename": entry.name,
+                    "path": entry.path,
+                    "size": entry.stat().st_size,
+                    "enabled": True,
+                })
+                seen_basenames.add(entry.name)
+            except OSError as e:
+                logger.warning(f"读取认证文件信息失败 {entry.path}: {e}")
+
+
 @router.get("/auth-files", response_model=List[AuthFileInfo])
-async def list_auth_files(_: bool = Depends(verify_config_access)):
+async def list_auth_files(_: bool = Depends(verify_api_key_access)):
     """列出所有认证文件
     
     返回 saved/ 和 active/ 目录中的所有认证文件
     - saved/ 目录：所有认证文件的存储库（主要来源）
     - active/ 目录：单实例模式的激活文件
     """
-    auth_files = []
+    global _auth_files_cache
+    cache_key = (_dir_mtime_ns(SAVED_AUTH_DIR), _dir_mtime_ns(ACTIVE_AUTH_DIR))
+    if _auth_files_cache is not None and _auth_files_cache[0] == cache_key:
+        return _auth_files_cache[1]
+    
+    auth_files: List[Dict] = []
     seen_basenames = set()  # 用于去重
     
-    # 优先列出 saved 目录中的文件（主要来源）
-    if os.path.exists(SAVED_AUTH_DIR):
-        pattern = os.path.join(SAVED_AUTH_DIR, "*.json")
-        for file_path in glob.glob(pattern):
-            try:
-                basename = os.path.basename(file_path)
-                if basename not in seen_basenames:
-                    stat = os.stat(file_path)
-                    auth_files.append({
-                        "filename": basename,
-                        "path": file_path,
-                        "size": stat.st_size,
-                        "enabled": True,
-                    })
-                    seen_basenames.add(basename)
-            except Exception as e:
-                logger.warning(f"读取认证文件信息失败 {file_path}: {e}")
-    
-    # 也列出 active 目录中的文件（如果不在 saved 中）
-    if os.path.exists(ACTIVE_AUTH_DIR):
-        pattern = os.path.join(ACTIVE_AUTH_DIR, "*.json")
-        for file_path in glob.glob(pattern):
-            try:
-                basename = os.path.basename(file_path)
-                if basename not in seen_basenames:
-                    stat = os.stat(file_path)
-                    auth_files.append({
-                        "filename": basename,
-                        "path": file_path,
-                        "size": stat.st_size,
-                        "enabled": True,
-                    })
-                    seen_basenames.add(basename)
-            except Exception as e:
-                logger.warning(f"读取认证文件信息失败 {file_path}: {e}")
+    # 优先列出 saved 目录中的文件（主要来源），再列出 active 目录中不在 saved 中的文件
+    for directory, mtime_ns in zip((SAVED_AUTH_DIR, ACTIVE_AUTH_DIR), cache_key):
+        if mtime_ns is None:
+            continue
+        try:
+            _scan_auth_files(directory, seen_basenames, auth_files)
+        except OSError as e:
+            logger.warning(f"读取认证文件目录失败 {directory}: {e}")
     
+    _auth_files_cache = (cache_key, auth_files)
     return auth_files
 
 
 @router.post("/auth-files/upload")
-async def upload_auth_file(file: UploadFile = File(...), _: bool = Depends(verify_config_access)):
+async def upload_auth_file(file: UploadFile = File(...), _: bool = Depends(verify_api_key_access)):
     """上传认证文件"""
     if not file.filename.endswith(".json"):
         raise HTTPException(status_code=400, detail="文件必须是 JSON 格式")
@@ -146,6 +137,7 @@ async def upload_auth_file(file: UploadFile = File(...), _: bool = Depends(verif
         
         with open(file_path, "wb") as f:
             f.write(content)
+        _invalidate_auth_files_cache()
         
         logger.info(f"认证文件已上传: {file.filename}")
         return {"message": "文件上传成功", "path": file_path}
@@ -158,7 +150,7 @@ async def upload_auth_file(file: UploadFile = File(...), _: bool = Depends(verif
 
 
 @router.delete("/auth-files/{filename}")
-async def delete_auth_file(filename: str, _: bool = Depends(verify_config_access)):
+async def delete_auth_file(filename: str, _: bool = Depends(verify_api_key_access)):
     """删除认证文件"""
     # 安全检查：只允许删除 saved 目录下的文件
     file_path = os.path.join(SAVED_AUTH_DIR, filename)
@@ -171,6 +163,7 @@ async def delete_auth_file(filename: str, _: bool = Depends(verify_config_access
     
     try:
         os.remove(file_path)
+        _invalidate_auth_files_cache()
         logger.info(f"认证文件已删除: {filename}")
         return {"message": "文件删除成功"}
     except Exception as e:
@@ -179,57 +172,62 @@ async def delete_auth_file(filename: str, _: bool = Depends(verify_config_access
 
 
 @router.get("/load-balance", response_model=LoadBalanceConfig)
-async def get_load_balance_config(_: bool = Depends(verify_config_access)):
+async def get_load_balance_config(_: bool = Depends(verify_api_key_access)):
     """获取负载均衡配置"""
-    enabled = instance_manager.get_enabled_instances()
     return {
         "strategy": instance_manager.strategy.value,
-        "enabled_instances": len(enabled),
+        "enabled_instances": instance_manager.enabled_count(),
         "total_instances": len(instance_manager.instances),
     }
 
 
 @router.post("/load-balance/strategy")
-async def set_load_balance_strategy(request: dict, _: bool = Depends(verify_config_access)):
+async def set_load_balance_strategy(request: dict, _: bool = Depends(verify_api_key_access)):
     """设置负载均衡策略"""
     strategy = request.get("strategy")
     if not strategy:
         raise HTTPException(status_code=400, detail="缺少 strategy 参数")
-    try:
-        strategy_enum = LoadBalanceStrategy(strategy)
-        instance_manager.set_strategy(strategy_enum)
-        return {"message": f"负载均衡策略已设置为: {strategy}"}
-    except ValueError:
+    strategy_enum = _STRATEGY_BY_VALUE.get(strategy)
+    if strategy_enum is None:
         raise HTTPException(
             status_code=400,
-            detail=f"无效的策略: {strategy}。可选值: {[s.value for s in LoadBalanceStrategy]}"
+            detail=f"无效的策略: {strategy}。可选值: {list(_STRATEGY_BY_VALUE)}"
         )
+    instance_manager.set_strategy(strategy_enum)
+    return {"message": f"负载均衡策略已设置为: {strategy}"}
 
 
 @router.get("/instances", response_model=List[InstanceStats])
-async def list_instances(_: bool = Depends(verify_config_access)):
+async def list_instances(_: bool = Depends(verify_api_key_access)):
     """列出所有实例及其统计信息"""
     stats = instance_manager.get_stats()
     return list(stats.values())
 
 
 @router.post("/instances/{instance_id}/enable")
-async def enable_instance(instance_id: str, enabled: bool = True, _: bool = Depends(verify_config_access)):
+async def enable_instance(instance_id: str, enabled: bool = True, _: bool = Depends(verify_api_key_access)):
     """启用/禁用实例"""
     instance_manager.enable_instance(instance_id, enabled)
     return {"message": f"实例 {instance_id} 已{'启用' if enabled else '禁用'}"}
 
 
 @router.get("/stats")
-async def get_stats(_: bool = Depends(verify_config_access)):
-    """获取详细统计信息"""
-    return {
-        "load_balance": {
-            "strategy": instance_manager.strategy.value,
-            "total_instances": len(instance_manager.instances),
-            "enabled_instances": len(instance_manager.get_enabled_instances()),
-        },
-        "instances": instance_manager.get_stats(),
-        "auth_files": await list_auth_files(),
+async def get_stats(_: bool = Depends(verify_api_key_access)):
+    """获取详细统计信息
+
+    实例统计使用管理器缓存的 JSON 字节直接拼接，跳过 FastAPI 的序列化
+    """
+    load_balance = {
+        "strategy": instance_manager.strategy.value,
+        "total_instances": len(instance_manager.instances),
+        "enabled_instances": instance_manager.enabled_count(),
+        "inflight_requests": instance_manager.total_inflight(),
     }
+    content = b"".join((
+        b'{"load_balance":', orjson.dumps(load_balance),
+        b',"instances":', instance_manager.get_stats_json(),
+        b',"auth_files":', orjson.dumps(await list_auth_files()),
+        b"}",
+    ))
+    return Response(content=content, media_type="application/json")
 
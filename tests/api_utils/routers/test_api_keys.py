@@ -2,14 +2,17 @@
 High-quality tests for api_utils/routers/api_keys.py - API key management endpoints.
 
 Focus: Test all 4 endpoints (get, add, test, delete) with success and error paths.
-Strategy: Mock auth_utils module and file operations, test validation and exception handling.
+Strategy: Mock auth_utils module (persistence helpers included), test validation and exception handling.
 """
 
-from unittest.mock import MagicMock, mock_open, patch
+import asyncio
+from unittest.mock import MagicMock, patch
 
 import pytest
 from fastapi import HTTPException
 
+from api_utils import auth_utils
+from api_utils.routers import api_keys
 from api_utils.routers.api_keys import (
     ApiKeyRequest,
     ApiKeyTestRequest,
@@ -25,11 +28,13 @@ from api_utils.routers.api_keys import (
 @pytest.fixture
 def mock_auth_utils():
     """Mock auth_utils module with API_KEYS set and KEY_FILE_PATH."""
-    with patch("api_utils.auth_utils") as mock_auth:
+    with patch("api_utils.routers.api_keys.auth_utils") as mock_auth:
         mock_auth.API_KEYS = set()
         mock_auth.KEY_FILE_PATH = "/fake/path/key.txt"
         mock_auth.initialize_keys = MagicMock()
         mock_auth.verify_api_key = MagicMock()
+        mock_auth.append_api_key = MagicMock()
+        mock_auth.write_api_keys = MagicMock()
         yield mock_auth
 
 
@@ -48,7 +53,7 @@ async def test_get_api_keys_success_with_keys(mock_auth_utils, mock_logger):
     # Setup: API_KEYS has 3 keys
     mock_auth_utils.API_KEYS = {"key1", "key2", "key3"}
 
-    response = await get_api_keys(logger=mock_logger)
+    response = await get_api_keys(request=MagicMock(), logger=mock_logger)
 
     # 验证: initialize_keys called (line 22)
     mock_auth_utils.initialize_keys.assert_called_once()
@@ -68,7 +73,7 @@ async def test_get_api_keys_success_empty(mock_auth_utils, mock_logger):
     """
     mock_auth_utils.API_KEYS = set()
 
-    response = await get_api_keys(logger=mock_logger)
+    response = await get_api_keys(request=MagicMock(), logger=mock_logger)
 
     # 验证: Empty keys list
     assert response.status_code == 200
@@ -85,7 +90,7 @@ async def test_get_api_keys_exception_handling(mock_auth_utils, mock_logger):
     mock_auth_utils.initialize_keys.side_effect = RuntimeError("File permission error")
 
     with pytest.raises(HTTPException) as exc_info:
-        await get_api_keys(logger=mock_logger)
+        await get_api_keys(request=MagicMock(), logger=mock_logger)
 
     # 验证: HTTPException 500
     assert exc_info.value.status_code == 500
@@ -105,20 +110,14 @@ async def test_add_api_key_success(mock_auth_utils, mock_logger):
     mock_auth_utils.API_KEYS = set()  # Initially empty
     request = ApiKeyRequest(key="valid-key-123456")
 
-    # Mock file operations
-    mock_file = mock_open(read_data="")
-    with patch("builtins.open", mock_file):
-        response = await add_api_key(request=request, logger=mock_logger)
+    response = await add_api_key(http_request=MagicMock(), request=request, logger=mock_logger)
 
-    # 验证: initialize_keys called twice (lines 41, 53)
-    assert mock_auth_utils.initialize_keys.call_count == 2
+    # 验证: in-memory set is authoritative, no reload from file
+    mock_auth_utils.initialize_keys.assert_not_called()
 
-    # 验证: File write (lines 47-51)
-    mock_file.assert_called()
-    handle = mock_file()
-    # Key written to file
-    written_data = "".join(call.args[0] for call in handle.write.call_args_list)
-    assert "valid-key-123456" in written_data
+    # 验证: Key persisted via append helper
+    mock_auth_utils.append_api_key.assert_called_once_with("valid-key-123456")
+    assert mock_auth_utils.API_KEYS == {"valid-key-123456"}
 
     # 验证: logger.info called (line 54)
     assert mock_logger.info.call_count == 1
@@ -140,7 +139,7 @@ async def test_add_api_key_invalid_empty(mock_logger):
     request = ApiKeyRequest(key="   ")  # Whitespace only
 
     with pytest.raises(HTTPException) as exc_info:
-        await add_api_key(request=request, logger=mock_logger)
+        await add_api_key(http_request=MagicMock(), request=request, logger=mock_logger)
 
     # 验证: HTTPException 400 (line 39)
     assert exc_info.value.status_code == 400
@@ -156,7 +155,7 @@ async def test_add_api_key_invalid_too_short(mock_logger):
     request = ApiKeyRequest(key="short")  # Only 5 characters
 
     with pytest.raises(HTTPException) as exc_info:
-        await add_api_key(request=request, logger=mock_logger)
+        await add_api_key(http_request=MagicMock(), request=request, logger=mock_logger)
 
     # 验证: HTTPException 400
     assert exc_info.value.status_code == 400
@@ -173,7 +172,7 @@ async def test_add_api_key_duplicate(mock_auth_utils, mock_logger):
     request = ApiKeyRequest(key="existing-key-123")
 
     with pytest.raises(HTTPException) as exc_info:
-        await add_api_key(request=request, logger=mock_logger)
+        await add_api_key(http_request=MagicMock(), request=request, logger=mock_logger)
 
     # 验证: HTTPException 400 (line 43)
     assert exc_info.value.status_code == 400
@@ -187,46 +186,22 @@ async def test_add_api_key_file_exception(mock_auth_utils, mock_logger):
     预期: 抛出HTTPException 500 (lines 62-64)
     """
     mock_auth_utils.API_KEYS = set()
+    mock_auth_utils.append_api_key.side_effect = IOError("Disk full")
     request = ApiKeyRequest(key="valid-key-123456")
 
-    # Mock file open to raise exception
-    with patch("builtins.open", side_effect=IOError("Disk full")):
-        with pytest.raises(HTTPException) as exc_info:
-            await add_api_key(request=request, logger=mock_logger)
+    with pytest.raises(HTTPException) as exc_info:
+        await add_api_key(http_request=MagicMock(), request=request, logger=mock_logger)
 
     # 验证: HTTPException 500 (line 64)
     assert exc_info.value.status_code == 500
     assert "Disk full" in exc_info.value.detail
+    assert mock_auth_utils.API_KEYS == set()
 
     # 验证: logger.error called (line 63)
     assert mock_logger.error.call_count == 1
     assert "添加API密钥失败" in mock_logger.error.call_args[0][0]
 
 
-@pytest.mark.asyncio
-async def test_add_api_key_appends_newline_when_file_has_content(
-    mock_auth_utils, mock_logger
-):
-    """
-    测试场景: 文件已有内容,添加密钥时追加换行符
-    预期: 写入换行符后写入密钥 (lines 48-51)
-    """
-    mock_auth_utils.API_KEYS = set()
-    request = ApiKeyRequest(key="new-key-987654")
-
-    # Mock file with existing content
-    mock_file = mock_open(read_data="existing-key\n")
-    with patch("builtins.open", mock_file):
-        await add_api_key(request=request, logger=mock_logger)
-
-    # 验证: Newline written before key (line 50)
-    handle = mock_file()
-    write_calls = [call.args[0] for call in handle.write.call_args_list]
-    # Should have both newline and key
-    assert any("\n" in call for call in write_calls)
-    assert any("new-key-987654" in call for call in write_calls)
-
-
 @pytest.mark.asyncio
 async def test_test_api_key_valid(mock_auth_utils, mock_logger):
     """
@@ -300,16 +275,14 @@ async def test_delete_api_key_success(mock_auth_utils, mock_logger):
     mock_auth_utils.API_KEYS = {"key-to-delete", "key-to-keep"}
     request = ApiKeyRequest(key="key-to-delete")
 
-    # Mock file operations
-    mock_file = mock_open(read_data="key-to-delete\nkey-to-keep\n")
-    with patch("builtins.open", mock_file):
-        response = await delete_api_key(request=request, logger=mock_logger)
+    response = await delete_api_key(http_request=MagicMock(), request=request, logger=mock_logger)
 
-    # 验证: initialize_keys called twice (lines 99, 111)
-    assert mock_auth_utils.initialize_keys.call_count == 2
+    # 验证: in-memory set is authoritative, no reload from file
+    mock_auth_utils.initialize_keys.assert_not_called()
 
-    # 验证: File read and write (lines 105-109)
-    assert mock_file.call_count == 2  # Once for read, once for write
+    # 验证: File rewritten from a snapshot, in-memory set updated afterwards
+    mock_auth_utils.write_api_keys.assert_called_once_with({"key-to-keep"})
+    assert mock_auth_utils.API_KEYS == {"key-to-keep"}
 
     # 验证: logger.info called (line 112)
     assert mock_logger.info.call_count == 1
@@ -331,7 +304,7 @@ async def test_delete_api_key_empty_validation(mock_logger):
     request = ApiKeyRequest(key="  ")  # Whitespace only
 
     with pytest.raises(HTTPException) as exc_info:
-        await delete_api_key(request=request, logger=mock_logger)
+        await delete_api_key(http_request=MagicMock(), request=request, logger=mock_logger)
 
     # 验证: HTTPException 400
     assert exc_info.value.status_code == 400
@@ -348,7 +321,7 @@ async def test_delete_api_key_not_found(mock_auth_utils, mock_logger):
     request = ApiKeyRequest(key="non-existent-key")
 
     with pytest.raises(HTTPException) as exc_info:
-        await delete_api_key(request=request, logger=mock_logger)
+        await delete_api_key(http_request=MagicMock(), request=request, logger=mock_logger)
 
     # 验证: HTTPException 404 (line 101)
     assert exc_info.value.status_code == 404
@@ -362,17 +335,58 @@ async def test_delete_api_key_file_exception(mock_auth_utils, mock_logger):
     预期: 抛出HTTPException 500 (lines 120-122)
     """
     mock_auth_utils.API_KEYS = {"key-to-delete"}
+    mock_auth_utils.write_api_keys.side_effect = IOError("Permission denied")
     request = ApiKeyRequest(key="key-to-delete")
 
-    # Mock file open to raise exception
-    with patch("builtins.open", side_effect=IOError("Permission denied")):
-        with pytest.raises(HTTPException) as exc_info:
-            await delete_api_key(request=request, logger=mock_logger)
+    with pytest.raises(HTTPException) as exc_info:
+        await delete_api_key(http_request=MagicMock(), request=request, logger=mock_logger)
 
     # 验证: HTTPException 500 (line 122)
     assert exc_info.value.status_code == 500
     assert "Permission denied" in exc_info.value.detail
+    assert mock_auth_utils.API_KEYS == {"key-to-delete"}
 
     # 验证: logger.error called (line 121)
     assert mock_logger.error.call_count == 1
     assert "删除API密钥失败" in mock_logger.error.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_add_and_delete_keep_file_in_sync(
+    tmp_path, monkeypatch, mock_logger
+):
+    """
+    测试场景: 并发删除与添加密钥(真实文件)
+    预期: 各请求串行执行，内存集合与 key.txt 保持一致
+    """
+    key_file = tmp_path / "key.txt"
+    keys = {"key-aaaaaaaa", "key-bbbbbbbb", "key-cccccccc"}
+    key_file.write_text("".join(f"{k}\n" for k in sorted(keys)))
+    monkeypatch.setattr(auth_utils, "KEY_FILE_PATH", str(key_file))
+    monkeypatch.setattr(auth_utils, "API_KEYS", set(keys))
+    monkeypatch.setattr(auth_utils, "_loaded_file_signature", None)
+    monkeypatch.setattr(auth_utils, "_last_check_monotonic", None)
+    monkeypatch.setattr(api_keys, "_key_update_lock", asyncio.Lock())
+
+    await asyncio.gather(
+        delete_api_key(
+            http_request=MagicMock(),
+            request=ApiKeyRequest(key="key-aaaaaaaa"),
+            logger=mock_logger,
+        ),
+        delete_api_key(
+            http_request=MagicMock(),
+            request=ApiKeyRequest(key="key-bbbbbbbb"),
+            logger=mock_logger,
+        ),
+        add_api_key(
+            http_request=MagicMock(),
+            request=ApiKeyRequest(key="key-dddddddd"),
+            logger=mock_logger,
+        ),
+    )
+
+    expected = {"key-cccccccc", "key-dddddddd"}
+    assert auth_utils.API_KEYS == expected
+    file_keys = {line for line in key_file.read_text().splitlines() if line}
+    assert file_keys == expected
@@ -0,0 +1,132 @@
+"""
+Tests for api_utils/routers/config.py - Auth file listing and load balance config.
+
+Focus: list_auth_files directory scanning, de-duplication and mtime-keyed caching;
+/stats response assembly.
+Strategy: Point SAVED_AUTH_DIR / ACTIVE_AUTH_DIR at tmp_path directories.
+"""
+
+import json
+import os
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import HTTPException
+
+from api_utils.instance_manager import LoadBalanceStrategy, MultiInstanceManager
+from api_utils.routers import config as config_router
+
+
+@pytest.fixture
+def auth_dirs(tmp_path, monkeypatch):
+    """Create temporary saved/ and active/ directories and reset the cache."""
+    saved = tmp_path / "saved"
+    active = tmp_path / "active"
+    saved.mkdir()
+    active.mkdir()
+    monkeypatch.setattr(config_router, "SAVED_AUTH_DIR", str(saved))
+    monkeypatch.setattr(config_router, "ACTIVE_AUTH_DIR", str(active))
+    monkeypatch.setattr(config_router, "_auth_files_cache", None)
+    return saved, active
+
+
+@pytest.mark.asyncio
+async def test_list_auth_files_dedups_saved_over_active(auth_dirs):
+    """
+    测试场景: saved/ 和 active/ 中存在同名文件
+    预期: 只返回 saved/ 中的文件，忽略非 JSON 文件
+    """
+    saved, active = auth_dirs
+    (saved / "a.json").write_text("{}")
+    (active / "a.json").write_text("{}")
+    (active / "b.json").write_text("{ }")
+    (active / "notes.txt").write_text("x")
+
+    files = await config_router.list_auth_files(True)
+
+    by_name = {f["filename"]: f for f in files}
+    assert set(by_name) == {"a.json", "b.json"}
+    assert by_name["a.json"]["path"] == os.path.join(str(saved), "a.json")
+    assert by_name["b.json"]["size"] == 3
+
+
+@pytest.mark.asyncio
+async def test_list_auth_files_cached_until_directory_changes(auth_dirs, monkeypatch):
+    """
+    测试场景: 目录未变化时重复调用
+    预期: 命中缓存不再扫描；目录新增文件后重新扫描
+    """
+    saved, _ = auth_dirs
+    (saved / "a.json").write_text("{}")
+
+    first = await config_router.list_auth_files(True)
+
+    scan_spy = MagicMock(wraps=config_router._scan_auth_files)
+    monkeypatch.setattr(config_router, "_scan_auth_files", scan_spy)
+    assert await config_router.list_auth_files(True) is first
+    scan_spy.assert_not_called()
+
+    (saved / "b.json").write_text("{}")
+    stat = os.stat(saved)
+    os.utime(saved, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    files = await config_router.list_auth_files(True)
+    assert {f["filename"] for f in files} == {"a.json", "b.json"}
+    scan_spy.assert_called()
+
+
+@pytest.mark.asyncio
+async def test_list_auth_files_missing_directories(tmp_path, monkeypatch):
+    """
+    测试场景: 认证目录不存在
+    预期: 返回空列表
+    """
+    monkeypatch.setattr(config_router, "SAVED_AUTH_DIR", str(tmp_path / "missing_saved"))
+    monkeypatch.setattr(config_router, "ACTIVE_AUTH_DIR", str(tmp_path / "missing_active"))
+    monkeypatch.setattr(config_router, "_auth_files_cache", None)
+
+    assert await config_router.list_auth_files(True) == []
+
+
+@pytest.mark.asyncio
+async def test_get_stats_returns_combined_json(auth_dirs, monkeypatch):
+    """
+    测试场景: 获取详细统计信息
+    预期: 返回包含负载均衡、实例与认证文件的 JSON 字节
+    """
+    saved, _ = auth_dirs
+    (saved / "a.json").write_text("{}")
+    manager = MultiInstanceManager()
+    monkeypatch.setattr(config_router, "instance_manager", manager)
+
+    response = await config_router.get_stats(True)
+
+    assert response.media_type == "application/json"
+    payload = json.loads(response.body)
+    assert payload["load_balance"] == {
+        "strategy": "round_robin",
+        "total_instances": 0,
+        "enabled_instances": 0,
+        "inflight_requests": 0,
+    }
+    assert payload["instances"] == {}
+    assert [f["filename"] for f in payload["auth_files"]] == ["a.json"]
+
+
+@pytest.mark.asyncio
+async def test_set_load_balance_strategy(monkeypatch):
+    """
+    测试场景: 设置合法与非法的负载均衡策略
+    预期: 合法值生效；非法值返回 400 并列出可选值
+    """
+    manager = MultiInstanceManager()
+    monkeypatch.setattr(config_router, "instance_manager", manager)
+
+    await config_router.set_load_balance_strategy({"strategy": "least_connections"}, True)
+    assert manager.strategy == LoadBalanceStrategy.LEAST_CONNECTIONS
+
+    with pytest.raises(HTTPException) as exc_info:
+        await config_router.set_load_balance_strategy({"strategy": "fastest"}, True)
+    assert exc_info.value.status_code == 400
+    assert "round_robin" in exc_info.value.detail
+    assert manager.strategy == LoadBalanceStrategy.LEAST_CONNECTIONS
@@ -1,14 +1,27 @@
 from unittest.mock import mock_open, patch
 
+import pytest
+
+from api_utils import auth_utils
 from api_utils.auth_utils import (
     API_KEYS,
     KEY_FILE_PATH,
+    append_api_key,
+    extract_api_key,
     initialize_keys,
     load_api_keys,
     verify_api_key,
+    write_api_keys,
 )
 
 
+@pytest.fixture(autouse=True)
+def reset_key_file_state(monkeypatch):
+    """Reset the key file reload bookkeeping so each test starts fresh."""
+    monkeypatch.setattr(auth_utils, "_loaded_file_signature", None)
+    monkeypatch.setattr(auth_utils, "_last_check_monotonic", None)
+
+
 def test_load_api_keys():
     """Test loading API keys from file."""
     mock_content = "key1\nkey2\n\nkey3"
@@ -39,3 +52,93 @@ def test_verify_api_key():
     API_KEYS.add("valid_key")
     assert verify_api_key("valid_key") is True
     assert verify_api_key("invalid_key") is False
+
+
+def test_initialize_keys_skips_reload_when_file_unchanged(tmp_path, monkeypatch):
+    """Test initialize_keys only re-reads the key file after it changes."""
+    key_file = tmp_path / "key.txt"
+    key_file.write_text("key1\n")
+    monkeypatch.setattr(auth_utils, "KEY_FILE_PATH", str(key_file))
+    monkeypatch.setattr(auth_utils, "KEY_FILE_CHECK_INTERVAL", 0.0)
+
+    initialize_keys()
+    assert API_KEYS == {"key1"}
+
+    with patch("api_utils.auth_utils.load_api_keys") as mock_load:
+        initialize_keys()
+        mock_load.assert_not_called()
+
+    key_file.write_text("key1\nkey2\n")
+    initialize_keys()
+    assert API_KEYS == {"key1", "key2"}
+    API_KEYS.clear()
+
+
+def test_extract_api_key():
+    """Test API key extraction from Authorization and X-API-Key headers."""
+    assert extract_api_key({"Authorization": "Bearer abc"}) == "abc"
+    assert extract_api_key({"X-API-Key": "xyz"}) == "xyz"
+    assert extract_api_key({"Authorization": "Bearer ", "X-API-Key": "xyz"}) == "xyz"
+    assert extract_api_key({"Authorization": "Basic abc"}) is None
+    assert extract_api_key({}) is None
+
+
+def test_append_api_key_adds_newline_separator(tmp_path, monkeypatch):
+    """Test append_api_key separates keys when the file lacks a trailing newline."""
+    key_file = tmp_path / "key.txt"
+    key_file.write_text("existing-key")
+    monkeypatch.setattr(auth_utils, "KEY_FILE_PATH", str(key_file))
+    API_KEYS.clear()
+    API_KEYS.add("existing-key")
+
+    append_api_key("new-key-987654")
+
+    assert key_file.read_text() == "existing-key\nnew-key-987654\n"
+    assert API_KEYS == {"existing-key"}
+    with patch("api_utils.auth_utils.load_api_keys") as mock_load:
+        initialize_keys()
+        mock_load.assert_not_called()
+    API_KEYS.clear()
+
+
+def test_write_api_keys_rewrites_file(tmp_path, monkeypatch):
+    """Test write_api_keys rewrites the file without touching API_KEYS."""
+    key_file = tmp_path / "key.txt"
+    key_file.write_text("key-to-delete\nkey-to-keep\n")
+    monkeypatch.setattr(auth_utils, "KEY_FILE_PATH", str(key_file))
+    API_KEYS.clear()
+    API_KEYS.update({"key-to-delete", "key-to-keep"})
+
+    write_api_keys({"key-to-keep"})
+
+    assert key_file.read_text() == "key-to-keep\n"
+    assert API_KEYS == {"key-to-delete", "key-to-keep"}
+    assert not (tmp_path / "key.txt.tmp").exists()
+    API_KEYS.clear()
+
+
+def test_load_api_keys_keeps_keys_on_read_error():
+    """Test a failed key file read leaves the previously loaded keys intact."""
+    API_KEYS.clear()
+    API_KEYS.add("old_key")
+    with patch("os.path.exists", return_value=True):
+        with patch("builtins.open", side_effect=OSError("read failed")):
+            with pytest.raises(OSError):
+                load_api_keys()
+    assert API_KEYS == {"old_key"}
+    API_KEYS.clear()
+
+
+def test_initialize_keys_debounces_stat(tmp_path, monkeypatch):
+    """Test initialize_keys skips the stat call within the check interval."""
+    key_file = tmp_path / "key.txt"
+    key_file.write_text("key1\n")
+    monkeypatch.setattr(auth_utils, "KEY_FILE_PATH", str(key_file))
+    monkeypatch.setattr(auth_utils, "KEY_FILE_CHECK_INTERVAL", 60.0)
+
+    initialize_keys()
+    with patch("api_utils.auth_utils.os.stat") as mock_stat:
+        initialize_keys()
+        mock_stat.assert_not_called()
+    assert API_KEYS == {"key1"}
+    API_KEYS.clear()
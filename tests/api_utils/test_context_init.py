@@ -18,6 +18,8 @@ from unittest.mock import MagicMock, patch
 import pytest
 
 from api_utils.context_init import initialize_request_context
+from api_utils.instance_manager import BrowserInstance, instance_manager
+from api_utils.load_balancer import load_balancer
 from api_utils.server_state import state
 
 
@@ -343,3 +345,50 @@ class TestInitializeRequestContext:
             async with context["params_cache_lock"]:
                 assert context["params_cache_lock"].locked()
             assert not context["params_cache_lock"].locked()
+
+    @pytest.mark.asyncio
+    async def test_load_balanced_instance_tracked_until_finished(
+        self, real_locks_mock_browser, make_chat_request
+    ):
+        """Test that a load-balanced instance stays in flight until the worker finishes it."""
+        state.current_ai_studio_model_id = "gemini-1.5-pro"
+        state.model_switching_lock = real_locks_mock_browser.model_switching_lock
+        state.params_cache_lock = real_locks_mock_browser.params_cache_lock
+        state.page_params_cache = {}
+        state.parsed_model_list = []
+
+        instance_page = MagicMock()
+        instance = BrowserInstance(
+            id="lb_instance",
+            auth_file="lb.json",
+            browser=MagicMock(),
+            page=instance_page,
+            is_ready=True,
+        )
+        instance_manager.clear()
+        instance_manager.add_instance(instance)
+        try:
+            request = make_chat_request(stream=True)
+            mock_time = MagicMock()
+            mock_time.monotonic.side_effect = [100.0, 100.5]
+
+            with (
+                patch("api_utils.server_state.state.logger", MagicMock()),
+                patch("api_utils.load_balancer.time", mock_time),
+            ):
+                context = await initialize_request_context("req11", request)
+
+                assert context["page"] is instance_page
+                assert instance_manager.get_inflight("lb_instance") == 1
+
+                load_balancer.finish_request("req11", succeeded=True)
+
+            assert instance_manager.get_inflight("lb_instance") == 0
+            assert instance.request_count == 1
+            assert instance.ewma_latency_ms == pytest.approx(500.0)
+
+            # Finishing twice is a no-op
+            load_balancer.finish_request("req11", succeeded=True)
+            assert instance_manager.get_inflight("lb_instance") == 0
+        finally:
+            instance_manager.clear()
@@ -704,6 +704,55 @@ class TestExecuteRequestLogic:
                 req_item["result_future"].result()
             assert http_exc.value.status_code == 500
 
+    @pytest.mark.asyncio
+    async def test_execute_request_finishes_instance_after_completion(self):
+        """Test that the load-balanced request ends only after completion monitoring."""
+        queue_manager = QueueManager()
+        queue_manager.logger = MagicMock()
+        result_future = asyncio.Future()
+        order = []
+
+        async def monitor(*args, **kwargs):
+            order.append("monitor")
+
+        with (
+            patch(
+                "api_utils._process_request_refactored",
+                new_callable=AsyncMock,
+                return_value=(asyncio.Event(), MagicMock(), MagicMock()),
+            ),
+            patch.object(queue_manager, "_monitor_completion", side_effect=monitor),
+            patch("api_utils.queue_worker.load_balancer") as mock_lb,
+        ):
+            mock_lb.finish_request.side_effect = lambda *args: order.append("finish")
+            await queue_manager._execute_request_logic(
+                "req1", MagicMock(), MagicMock(), result_future
+            )
+
+        assert order == ["monitor", "finish"]
+        mock_lb.finish_request.assert_called_once_with("req1", True)
+
+    @pytest.mark.asyncio
+    async def test_execute_request_error_finishes_instance_as_failed(self):
+        """Test that a failed attempt releases the instance without a latency sample."""
+        queue_manager = QueueManager()
+        queue_manager.logger = MagicMock()
+
+        with (
+            patch(
+                "api_utils._process_request_refactored",
+                new_callable=AsyncMock,
+                side_effect=Exception("Processing failed"),
+            ),
+            patch("api_utils.queue_worker.load_balancer") as mock_lb,
+        ):
+            with pytest.raises(Exception):
+                await queue_manager._execute_request_logic(
+                    "req1", MagicMock(), MagicMock(), asyncio.Future()
+                )
+
+        mock_lb.finish_request.assert_called_once_with("req1", False)
+
 
 class TestMonitorCompletion:
     """Tests for _monitor_completion method."""
@@ -1776,6 +1776,51 @@ class TestProcessRequestRefactoredExceptionHandling:
             assert isinstance(exc, HTTPException)
             assert exc.status_code == 503
 
+    @pytest.mark.asyncio
+    async def test_process_request_model_analysis_error_is_handled(
+        self, mock_request, mock_http_request, make_request_context
+    ):
+        """Test that a failure right after context init sets the future and cleans up."""
+        mock_future = asyncio.Future()
+        context = make_request_context(browser_instance=MagicMock())
+
+        with (
+            patch(
+                "api_utils.request_processor._check_client_connection",
+                new_callable=AsyncMock,
+                return_value=True,
+            ),
+            patch("config.get_environment_variable", return_value="0"),
+            patch(
+                "api_utils.request_processor._initialize_request_context",
+                new_callable=AsyncMock,
+                return_value=context,
+            ),
+            patch(
+                "api_utils.request_processor._analyze_model_requirements",
+                new_callable=AsyncMock,
+                side_effect=HTTPException(status_code=400, detail="unknown model"),
+            ),
+            patch(
+                "api_utils.request_processor._setup_disconnect_monitoring",
+                new_callable=AsyncMock,
+            ) as mock_setup,
+            patch(
+                "api_utils.request_processor._cleanup_request_resources",
+                new_callable=AsyncMock,
+            ) as mock_cleanup,
+        ):
+            result = await _process_request_refactored(
+                "req1", mock_request, mock_http_request, mock_future
+            )
+
+            assert result is None
+            exc = mock_future.exception()
+            assert isinstance(exc, HTTPException)
+            assert exc.status_code == 400
+            mock_setup.assert_not_called()
+            mock_cleanup.assert_called_once()
+
     @pytest.mark.asyncio
     async def test_process_request_cancelled_error_handling(
         self, mock_request, mock_http_request, make_request_context
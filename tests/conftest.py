@@ -8,6 +8,19 @@ import pytest
 # Note: Session-level cleanup hooks removed as they cause recursion issues on Windows
 # Rely on pytest-asyncio's natural cleanup and explicit fixture teardown instead
 
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
+
+
+@pytest.fixture(scope="session")
+def event_loop_policy():
+    """Run async tests on uvloop when installed, as uvicorn does in production."""
+    if uvloop is None:
+        return asyncio.DefaultEventLoopPolicy()
+    return uvloop.EventLoopPolicy()
+
 
 @pytest.fixture(autouse=True)
 def mock_server_module():
@@ -3,6 +3,11 @@
 """
 import pytest
 import asyncio
+import json
+import random
+import sys
+import time
+from unittest.mock import MagicMock
 from api_utils.instance_manager import (
     MultiInstanceManager,
     BrowserInstance,
@@ -11,7 +16,7 @@ from api_utils.instance_manager import (
 from api_utils.load_balancer import LoadBalancer
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_browser():
     """模拟浏览器对象"""
     class MockBrowser:
@@ -21,7 +26,7 @@ def mock_browser():
     return MockBrowser()
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def mock_page():
     """模拟页面对象"""
     class MockPage:
@@ -36,102 +41,435 @@ def instance_manager():
     return MultiInstanceManager()
 
 
-@pytest.mark.asyncio
-async def test_round_robin_strategy(instance_manager, mock_browser, mock_page):
-    """测试轮询策略"""
-    instance_manager.set_strategy(LoadBalanceStrategy.ROUND_ROBIN)
+@pytest.fixture
+def seeded_random(monkeypatch):
+    """让实例管理器使用独立的固定种子随机数，不影响全局 random 状态"""
+    rng = random.Random(0)
+    monkeypatch.setattr("api_utils.instance_manager.random", rng)
+    return rng
+
+
+class FakeClock:
+    """可手动推进的 monotonic 时钟"""
+    def __init__(self, now):
+        self.now = now
+    
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """冻结实例管理器中的时间，由测试手动推进"""
+    clock = FakeClock(time.monotonic())
+    monkeypatch.setattr("api_utils.instance_manager.time", clock)
+    return clock
+
+
+@pytest.fixture
+def global_instance_manager():
+    """全局实例管理器，测试前后清空，避免状态泄漏到其他测试"""
+    from api_utils.instance_manager import instance_manager
     
-    # 添加3个实例
-    for i in range(3):
-        instance = BrowserInstance(
+    instance_manager.clear()
+    yield instance_manager
+    instance_manager.clear()
+
+
+def _add_n(manager, n, browser, page, **kwargs):
+    """向管理器批量添加 n 个就绪实例；kwargs 中的可调用值按实例下标求值"""
+    instances = []
+    for i in range(n):
+        fields = {"is_ready": True}
+        fields.update({k: v(i) if callable(v) else v for k, v in kwargs.items()})
+        instances.append(BrowserInstance(
             id=f"instance_{i}",
             auth_file=f"auth_{i}.json",
-            browser=mock_browser,
-            page=mock_page,
-            is_ready=True,
-        )
-        instance_manager.add_instance(instance)
+            browser=browser,
+            page=page,
+            **fields,
+        ))
+    manager.add_instances(instances)
+    return instances
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("strategy,expected", [
+    # 按顺序轮询
+    (LoadBalanceStrategy.ROUND_ROBIN, ["instance_0", "instance_1", "instance_2"] * 2),
+    # 始终选择处理中请求最少的实例0
+    (LoadBalanceStrategy.LEAST_CONNECTIONS, ["instance_0"] * 6),
+])
+async def test_strategy(instance_manager, mock_browser, mock_page, strategy, expected):
+    """测试各策略的选择顺序"""
+    instance_manager.set_strategy(strategy)
+    _add_n(
+        instance_manager, 3, mock_browser, mock_page,
+        active_requests=lambda i: i,
+    )
     
-    # 测试轮询
-    instances = []
-    for _ in range(6):
-        inst = await instance_manager.get_next_instance()
-        instances.append(inst.id)
+    ids = [(await instance_manager.get_next_instance()).id for _ in range(6)]
+    assert ids == expected
+
+
+@pytest.mark.asyncio
+async def test_round_robin_concurrent_requests(instance_manager, mock_browser, mock_page):
+    """测试并发请求下轮询仍均匀分配"""
+    instance_manager.set_strategy(LoadBalanceStrategy.ROUND_ROBIN)
     
-    # 应该按顺序轮询
-    assert instances == [
-        "instance_0", "instance_1", "instance_2",
-        "instance_0", "instance_1", "instance_2"
-    ]
+    _add_n(instance_manager, 3, mock_browser, mock_page)
+    
+    results = await asyncio.gather(*(instance_manager.get_next_instance() for _ in range(30)))
+    ids = [inst.id for inst in results]
+    assert all(ids.count(f"instance_{i}") == 10 for i in range(3))
 
 
 @pytest.mark.asyncio
-async def test_least_connections_strategy(instance_manager, mock_browser, mock_page):
-    """测试最少连接策略"""
-    instance_manager.set_strategy(LoadBalanceStrategy.LEAST_CONNECTIONS)
+async def test_round_robin_after_instance_removed(instance_manager, mock_browser, mock_page):
+    """测试移除实例后轮询只在剩余实例间交替"""
+    instance_manager.set_strategy(LoadBalanceStrategy.ROUND_ROBIN)
     
-    # 添加3个实例，设置不同的请求数
-    for i in range(3):
-        instance = BrowserInstance(
-            id=f"instance_{i}",
-            auth_file=f"auth_{i}.json",
-            browser=mock_browser,
-            page=mock_page,
-            is_ready=True,
-            request_count=i,  # 实例0请求数最少
-        )
-        instance_manager.add_instance(instance)
+    _add_n(instance_manager, 3, mock_browser, mock_page)
+    
+    await instance_manager.get_next_instance()
+    instance_manager.remove_instance("instance_1")
+    
+    ids = [(await instance_manager.get_next_instance()).id for _ in range(4)]
+    assert sorted(ids) == ["instance_0", "instance_0", "instance_2", "instance_2"]
+    assert ids[0] != ids[1]
+
+
+@pytest.mark.asyncio
+async def test_least_latency_tracks_request_end(instance_manager, mock_browser, mock_page, fake_clock):
+    """测试最低延迟策略随请求耗时 EWMA 更新（两个实例时二选一即比较全部实例）"""
+    instance_manager.set_strategy(LoadBalanceStrategy.LEAST_LATENCY)
+    
+    # 记录不同的响应耗时，实例1延迟最低
+    for i, instance in enumerate(_add_n(instance_manager, 2, mock_browser, mock_page)):
+        instance_manager.mark_request_end(instance.id, 200.0 - i * 100)
+    
+    instance = await instance_manager.get_next_instance()
+    assert instance.id == "instance_1"
+    assert instance.ewma_latency_ms == 100.0
     
-    # 应该选择请求数最少的实例
+    # 实例1变慢后，EWMA 平滑更新：0.8 * 100 + 0.2 * 1100 = 300，不再是最低
+    instance_manager.mark_request_end(instance.id, 1100.0)
+    assert instance.ewma_latency_ms == pytest.approx(300.0)
     instance = await instance_manager.get_next_instance()
     assert instance.id == "instance_0"
-    assert instance.request_count == 0
+    
+    # 处理中的请求会按 (处理中请求数 + 1) 放大得分：200 * 2 > 300
+    instance_manager.mark_request_start("instance_0")
+    instance = await instance_manager.get_next_instance()
+    assert instance.id == "instance_1"
+
+
+@pytest.mark.asyncio
+async def test_least_latency_recovers_after_slow_sample(
+    instance_manager, mock_browser, mock_page, seeded_random, fake_clock
+):
+    """测试单次慢请求不会让实例永久落选：闲置衰减后重新获得请求，且负载不集中在单个实例"""
+    instance_manager.set_strategy(LoadBalanceStrategy.LEAST_LATENCY)
+    instances = _add_n(instance_manager, 3, mock_browser, mock_page)
+    instance_manager.mark_request_end("instance_0", 5000.0)  # 一次很长的回答
+    instance_manager.mark_request_end("instance_1", 110.0)
+    instance_manager.mark_request_end("instance_2", 120.0)
+    
+    for _ in range(60):
+        inst = await instance_manager.get_next_instance()
+        instance_manager.mark_request_start(inst.id)
+        fake_clock.now += 5.0
+        instance_manager.mark_request_end(inst.id, 100.0 + 10 * int(inst.id[-1]))
+    
+    counts = [inst.request_count for inst in instances]
+    assert sum(counts) == 60
+    assert counts[0] > 0
+    assert max(counts) < 45
+
+
+@pytest.mark.asyncio
+async def test_least_latency_avoids_failing_instance(
+    instance_manager, mock_browser, mock_page, seeded_random, fake_clock
+):
+    """测试持续失败的实例按惩罚耗时计入延迟，不会因为没有成功样本而被优先选中"""
+    instance_manager.set_strategy(LoadBalanceStrategy.LEAST_LATENCY)
+    instances = _add_n(instance_manager, 3, mock_browser, mock_page)
+    
+    for _ in range(300):
+        inst = await instance_manager.get_next_instance()
+        instance_manager.mark_request_start(inst.id)
+        fake_clock.now += 1.0
+        if inst.id == "instance_0":
+            # 实例0的请求总是很快失败
+            instance_manager.mark_request_end(inst.id, 50.0, failed=True)
+        else:
+            instance_manager.mark_request_end(inst.id, 1000.0)
+    
+    assert instances[0].ewma_latency_ms >= 1000.0
+    counts = [inst.request_count for inst in instances]
+    assert sum(counts) == 300
+    assert counts[0] < 30
+
+
+@pytest.mark.asyncio
+async def test_concurrent_request_marks_are_counted(instance_manager, mock_browser, mock_page):
+    """测试并发任务标记请求时计数不丢失，结束标记不会使计数下溢"""
+    (instance,) = _add_n(instance_manager, 1, mock_browser, mock_page)
+    
+    async def handle():
+        instance_manager.mark_request_start(instance.id)
+        await asyncio.sleep(0)
+        instance_manager.mark_request_end(instance.id, 1.0)
+    
+    await asyncio.gather(*(handle() for _ in range(100)))
+    assert instance.request_count == 100
+    assert instance.active_requests == 0
+    
+    instance_manager.mark_request_end(instance.id, 1.0)
+    assert instance.active_requests == 0
+
+
+@pytest.mark.asyncio
+async def test_power_of_two_choices_strategy(instance_manager, mock_browser, mock_page, seeded_random):
+    """测试随机二选一策略：多次选择后负载分布接近均匀"""
+    instance_manager.set_strategy(LoadBalanceStrategy.POWER_OF_TWO_CHOICES)
+    
+    _add_n(instance_manager, 4, mock_browser, mock_page)
+    
+    for _ in range(400):
+        inst = await instance_manager.get_next_instance()
+        instance_manager.mark_request_start(inst.id)
+    
+    counts = [inst.request_count for inst in instance_manager.instances.values()]
+    assert sum(counts) == 400
+    # 每次都偏向较空闲的实例，各实例请求数应非常接近
+    assert max(counts) - min(counts) <= 5
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("strategy", list(LoadBalanceStrategy))
+async def test_single_instance_fast_path(instance_manager, mock_browser, mock_page, strategy):
+    """测试只有一个可用实例时各策略都直接返回该实例"""
+    instance_manager.set_strategy(strategy)
+    _add_n(instance_manager, 2, mock_browser, mock_page, enabled=lambda i: i == 0)
+    
+    ids = [(await instance_manager.get_next_instance()).id for _ in range(3)]
+    assert ids == ["instance_0"] * 3
 
 
 @pytest.mark.asyncio
 async def test_enabled_instances_only(instance_manager, mock_browser, mock_page):
     """测试只返回启用的实例"""
     # 添加3个实例，禁用其中一个
-    for i in range(3):
-        instance = BrowserInstance(
-            id=f"instance_{i}",
-            auth_file=f"auth_{i}.json",
-            browser=mock_browser,
-            page=mock_page,
-            is_ready=True,
-            enabled=(i != 1),  # 禁用实例1
-        )
-        instance_manager.add_instance(instance)
+    _add_n(instance_manager, 3, mock_browser, mock_page, enabled=lambda i: i != 1)  # 禁用实例1
     
     enabled = instance_manager.get_enabled_instances()
     assert len(enabled) == 2
+    assert instance_manager.enabled_count() == 2
     assert all(inst.id != "instance_1" for inst in enabled)
 
 
 @pytest.mark.asyncio
-async def test_load_balancer_integration():
-    """测试负载均衡器集成"""
-    from api_utils.instance_manager import instance_manager
+async def test_least_connections_tracks_request_start(instance_manager, mock_browser, mock_page):
+    """测试最少连接策略按处理中请求数选择，请求结束后释放"""
+    instance_manager.set_strategy(LoadBalanceStrategy.LEAST_CONNECTIONS)
     
-    # 重置管理器
-    instance_manager.instances.clear()
-    instance_manager.current_index = 0
+    _add_n(instance_manager, 2, mock_browser, mock_page)
     
-    # 添加测试实例
-    class MockBrowser:
-        pass
+    instance_manager.mark_request_start("instance_0")
+    instance = await instance_manager.get_next_instance()
+    assert instance.id == "instance_1"
     
-    class MockPage:
-        pass
+    # 实例0的请求结束后处理中数量低于实例1，累计请求数则保持不变
+    instance_manager.mark_request_start("instance_1")
+    instance_manager.mark_request_end("instance_0", 1.0)
+    instance = await instance_manager.get_next_instance()
+    assert instance.id == "instance_0"
+    assert instance.request_count == 1
+    assert instance_manager.get_inflight("instance_0") == 0
+    assert instance_manager.get_inflight("instance_1") == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("strategy", [
+    LoadBalanceStrategy.LEAST_CONNECTIONS,
+    LoadBalanceStrategy.POWER_OF_TWO_CHOICES,
+])
+async def test_sequential_requests_spread_load(
+    instance_manager, mock_browser, mock_page, seeded_random, strategy
+):
+    """测试串行处理（处理中请求数始终为 0）时按累计请求数打破平局，负载仍均匀分配"""
+    instance_manager.set_strategy(strategy)
+    _add_n(instance_manager, 3, mock_browser, mock_page)
+    
+    for _ in range(30):
+        inst = await instance_manager.get_next_instance()
+        instance_manager.mark_request_start(inst.id)
+        instance_manager.mark_request_end(inst.id, 1.0)
+    
+    counts = [inst.request_count for inst in instance_manager.instances.values()]
+    assert sum(counts) == 30
+    assert max(counts) - min(counts) <= 2
+
+
+@pytest.mark.asyncio
+async def test_least_connections_matches_linear_min(instance_manager, mock_browser, mock_page):
+    """测试最少连接堆与线性最小值扫描结果一致"""
+    instance_manager.set_strategy(LoadBalanceStrategy.LEAST_CONNECTIONS)
+    
+    _add_n(instance_manager, 20, mock_browser, mock_page, active_requests=lambda i: (i * 7) % 5)
+    
+    rng = random.Random(0)
+    for _ in range(300):
+        roll = rng.random()
+        if roll < 0.3:
+            instance_manager.mark_request_start(f"instance_{rng.randrange(20)}")
+        elif roll < 0.6:
+            instance_manager.mark_request_end(f"instance_{rng.randrange(20)}", 1.0)
+        else:
+            inst = await instance_manager.get_next_instance()
+            instance_manager.mark_request_start(inst.id)
+        
+        expected = min(
+            instance_manager.get_enabled_instances(),
+            key=lambda x: (x.active_requests, x.request_count),
+        )
+        inst = await instance_manager.get_next_instance()
+        assert inst.id == expected.id
+
+
+@pytest.mark.asyncio
+async def test_switch_to_least_connections_uses_current_counts(instance_manager, mock_browser, mock_page):
+    """测试切换到最少连接策略时按当前请求数选择"""
+    instance_manager.set_strategy(LoadBalanceStrategy.ROUND_ROBIN)
+    
+    _add_n(instance_manager, 50, mock_browser, mock_page)
+    
+    # 轮询策略下依次使用前 49 个实例
+    for _ in range(49):
+        inst = await instance_manager.get_next_instance()
+        instance_manager.mark_request_start(inst.id)
+    
+    instance_manager.set_strategy(LoadBalanceStrategy.LEAST_CONNECTIONS)
+    inst = await instance_manager.get_next_instance()
+    assert inst.id == "instance_49"
+
+
+def test_add_instances_rebuilds_snapshot_once(instance_manager, mock_browser, mock_page, monkeypatch):
+    """测试批量添加实例只重建一次快照，且保持添加顺序"""
+    rebuild_spy = MagicMock(wraps=instance_manager._rebuild_snapshot)
+    monkeypatch.setattr(instance_manager, "_rebuild_snapshot", rebuild_spy)
+    
+    _add_n(instance_manager, 5, mock_browser, mock_page)
+    
+    rebuild_spy.assert_called_once()
+    assert [inst.id for inst in instance_manager.get_enabled_instances()] == [
+        f"instance_{i}" for i in range(5)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_ready_state_change_updates_enabled(instance_manager, mock_browser, mock_page):
+    """测试就绪状态变更后可用实例同步更新"""
+    instance = BrowserInstance(
+        id="instance_0",
+        auth_file="auth_0.json",
+        browser=mock_browser,
+        page=mock_page,
+    )
+    instance_manager.add_instance(instance)
+    assert instance_manager.get_enabled_instances() == []
+    
+    instance_manager.set_instance_ready("instance_0", True)
+    assert [inst.id for inst in instance_manager.get_enabled_instances()] == ["instance_0"]
+    
+    instance_manager.enable_instance("instance_0", False)
+    assert await instance_manager.get_next_instance() is None
+
+
+def test_stats_json_cached_until_membership_changes(instance_manager, mock_browser, mock_page):
+    """测试统计 JSON 在有效期内复用，成员变更后重新生成"""
+    instance = BrowserInstance(
+        id="instance_0",
+        auth_file="auth_0.json",
+        browser=mock_browser,
+        page=mock_page,
+        is_ready=True,
+    )
+    instance_manager.add_instance(instance)
+    
+    first = instance_manager.get_stats_json()
+    assert json.loads(first)["instance_0"]["request_count"] == 0
     
+    instance_manager.mark_request_start("instance_0")
+    assert instance_manager.get_stats_json() is first
+    
+    instance_manager.enable_instance("instance_0", False)
+    stats = json.loads(instance_manager.get_stats_json())
+    assert stats["instance_0"]["enabled"] is False
+    assert stats["instance_0"]["request_count"] == 1
+
+
+@pytest.mark.skipif(sys.version_info < (3, 10), reason="dataclass slots 需要 Python 3.10+")
+def test_browser_instance_uses_slots(mock_browser, mock_page):
+    """测试 BrowserInstance 使用 __slots__，不再携带实例 __dict__"""
+    instance = BrowserInstance(
+        id="instance_0",
+        auth_file="auth_0.json",
+        browser=mock_browser,
+        page=mock_page,
+    )
+    assert not hasattr(instance, "__dict__")
+    with pytest.raises(AttributeError):
+        instance.unknown_field = 1
+
+
+@pytest.mark.asyncio
+async def test_direct_flag_change_invalidates_snapshot(instance_manager, mock_browser, mock_page):
+    """测试直接修改 enabled / is_ready 时可用实例同步更新"""
+    instances = _add_n(instance_manager, 2, mock_browser, mock_page)
+    
+    instances[0].enabled = False
+    assert [inst.id for inst in instance_manager.get_enabled_instances()] == ["instance_1"]
+    
+    instances[1].is_ready = False
+    assert await instance_manager.get_next_instance() is None
+    
+    # 移除后的实例不再影响管理器
+    instance_manager.remove_instance("instance_0")
+    instances[0].enabled = True
+    assert instance_manager.get_enabled_instances() == []
+
+
+def test_unchanged_flag_write_keeps_snapshot(instance_manager, mock_browser, mock_page):
+    """测试写入相同的 enabled / is_ready 值或其他字段时不重建快照"""
+    (instance,) = _add_n(instance_manager, 1, mock_browser, mock_page)
+    snapshot = instance_manager._enabled_snapshot
+    stats = instance_manager.get_stats_json()
+    
+    instance_manager.enable_instance("instance_0", True)
+    instance_manager.set_instance_ready("instance_0", True)
+    instance.error_count = 3
+    
+    assert instance_manager._enabled_snapshot is snapshot
+    assert instance_manager.get_stats_json() is stats
+    
+    instance.enabled = False
+    assert instance_manager._enabled_snapshot == ()
+
+
+@pytest.mark.asyncio
+async def test_load_balancer_integration(global_instance_manager, mock_browser, mock_page):
+    """测试负载均衡器集成"""
+    # 添加测试实例
     instance = BrowserInstance(
         id="test_instance",
         auth_file="test.json",
-        browser=MockBrowser(),
-        page=MockPage(),
+        browser=mock_browser,
+        page=mock_page,
         is_ready=True,
     )
-    instance_manager.add_instance(instance)
+    global_instance_manager.add_instance(instance)
     
     # 测试获取实例
     balancer = LoadBalancer()
@@ -142,11 +480,18 @@ async def test_load_balancer_integration():
     # 测试标记请求
     balancer.mark_request_start(inst)
     assert inst.request_count == 1
+    assert global_instance_manager.get_inflight("test_instance") == 1
     
     # 测试获取统计
     stats = balancer.get_stats()
     assert stats["total_instances"] == 1
     assert stats["enabled_instances"] == 1
+    assert stats["inflight_requests"] == 1
+    
+    # 请求结束后处理中数量归零，累计请求数保留
+    balancer.mark_request_end(inst, 10.0)
+    assert global_instance_manager.get_inflight("test_instance") == 0
+    assert inst.request_count == 1
 
 
 if __name__ == "__main__":